@@ -1,15 +1,72 @@
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 from app import models, schemas
-from passlib.context import CryptContext
+import base64
+import binascii
 import hashlib
-import json
+import hmac
+import os
 
-# Используем pbkdf2_sha256 вместо bcrypt
-pwd_context = CryptContext(
-    schemes=["pbkdf2_sha256"],
-    default="pbkdf2_sha256",
-    pbkdf2_sha256__default_rounds=30000
-)
+class PBKDF2Hasher:
+    """
+    Хеширование паролей через hashlib.pbkdf2_hmac (реализация OpenSSL на C)
+    в формате pbkdf2_sha256$rounds$salt$hash
+    """
+    algorithm = "pbkdf2_sha256"
+    # Формат хешей, созданных passlib: $pbkdf2-sha256$rounds$salt$hash
+    legacy_prefix = "$pbkdf2-sha256$"
+
+    def __init__(self, rounds: int = 30000, salt_size: int = 16, key_length: int = 32):
+        self.rounds = rounds
+        self.salt_size = salt_size
+        self.key_length = key_length
+
+    def _derive(self, password: str, salt: bytes, rounds: int, key_length: int) -> bytes:
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, rounds, key_length)
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(self.salt_size)
+        derived = self._derive(password, salt, self.rounds, self.key_length)
+        return "$".join([
+            self.algorithm,
+            str(self.rounds),
+            base64.b64encode(salt).decode("ascii"),
+            base64.b64encode(derived).decode("ascii")
+        ])
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        try:
+            if hashed_password.startswith(self.legacy_prefix):
+                # passlib использует adapted base64: "." вместо "+" и без паддинга
+                rounds, salt, stored = hashed_password[len(self.legacy_prefix):].split("$")
+                salt, stored = self._ab64_decode(salt), self._ab64_decode(stored)
+            else:
+                algorithm, rounds, salt, stored = hashed_password.split("$")
+                if algorithm != self.algorithm:
+                    return False
+                salt, stored = base64.b64decode(salt), base64.b64decode(stored)
+            rounds = int(rounds)
+            # Иначе pbkdf2_hmac упадет с ValueError уже вне try
+            if rounds <= 0 or not stored:
+                raise ValueError("malformed password hash")
+        except (AttributeError, ValueError, binascii.Error):
+            # Выполняем полный расчет и для битого хеша, чтобы время ответа не отличалось
+            self._derive(password, bytes(self.salt_size), self.rounds, self.key_length)
+            return False
+
+        computed = self._derive(password, salt, rounds, len(stored))
+        return hmac.compare_digest(computed, stored)
+
+    @staticmethod
+    def _ab64_decode(value: str) -> bytes:
+        value = value.replace(".", "+")
+        return base64.b64decode(value + "=" * (-len(value) % 4))
+
+pwd_context = PBKDF2Hasher(rounds=30000)
+
+# Хеш для проверки пароля несуществующего пользователя: время ответа /login
+# не должно выдавать, зарегистрирован ли email
+DUMMY_HASH = pwd_context.hash("dummy-password")
 
 def get_password_hash(password):
     return pwd_context.hash(password)
@@ -17,14 +74,26 @@ def get_password_hash(password):
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+def get_auth_row(db: Session, email: str):
+    # Только колонки, нужные для входа и сессии - без создания ORM-объекта User
+    return db.query(models.User).with_entities(
+        models.User.id,
+        models.User.email,
+        models.User.username,
+        models.User.hashed_password
+    ).filter(models.User.email == email).first()
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+def check_user_conflicts(db: Session, email: str, username: str):
+    # Одним запросом получаем два флага EXISTS - без загрузки строк пользователей
+    email_taken, username_taken = db.query(
+        exists().where(models.User.email == email),
+        exists().where(models.User.username == username)
+    ).one()
+    return bool(email_taken), bool(username_taken)
 
 def get_user_by_id(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    # Session.get сначала смотрит в identity map и не компилирует запрос заново
+    return db.get(models.User, user_id)
 
 def create_user(db: Session, user: schemas.UserCreate):
     hashed_password = get_password_hash(user.password)
@@ -35,97 +104,71 @@ def create_user(db: Session, user: schemas.UserCreate):
     )
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
-
 def authenticate_user(db: Session, email: str, password: str):
-    user = get_user_by_email(db, email)
-    if not user:
+    auth_row = get_auth_row(db, email)
+    if not auth_row:
+        verify_password(password, DUMMY_HASH)
         return False
-    if not verify_password(password, user.hashed_password):
+    if not verify_password(password, auth_row.hashed_password):
         return False
-    return user
+    return auth_row
 
 def get_preferences_by_user_id(db: Session, user_id: int):
     return db.query(models.UserPreferences).filter(models.UserPreferences.user_id == user_id).first()
 
+def _normalize(items):
+    # Нормализуем список перед сохранением; пустой список храним как NULL
+    return [item.strip().lower() for item in items] if items else None
+
 def create_user_preferences(db: Session, preferences: schemas.PreferencesCreate, user_id: int):
-    # Нормализуем данные перед сохранением
-    normalized_categories = [cat.strip().lower() for cat in preferences.preferred_categories] if preferences.preferred_categories else []
-    normalized_languages = [lang.strip().lower() for lang in preferences.preferred_languages] if preferences.preferred_languages else []
-    
     db_preferences = models.UserPreferences(
         user_id=user_id,
-        preferred_categories=json.dumps(normalized_categories, ensure_ascii=False) if normalized_categories else None,
+        preferred_categories=_normalize(preferences.preferred_categories),
         min_duration_minutes=preferences.min_duration_minutes,
         max_duration_minutes=preferences.max_duration_minutes,
-        preferred_languages=json.dumps(normalized_languages, ensure_ascii=False) if normalized_languages else None,
+        preferred_languages=_normalize(preferences.preferred_languages),
         exclude_explicit_content=preferences.exclude_explicit_content,
         educational_preference=preferences.educational_preference,
         entertainment_preference=preferences.entertainment_preference
     )
     db.add(db_preferences)
     db.commit()
-    db.refresh(db_preferences)
     return db_preferences
 
 def update_user_preferences(db: Session, preferences: schemas.PreferencesCreate, user_id: int):
     db_preferences = get_preferences_by_user_id(db, user_id)
     if db_preferences:
-        # Нормализуем данные перед сохранением
-        normalized_categories = [cat.strip().lower() for cat in preferences.preferred_categories] if preferences.preferred_categories else []
-        normalized_languages = [lang.strip().lower() for lang in preferences.preferred_languages] if preferences.preferred_languages else []
-        
-        db_preferences.preferred_categories = json.dumps(normalized_categories, ensure_ascii=False) if normalized_categories else None
+        db_preferences.preferred_categories = _normalize(preferences.preferred_categories)
         db_preferences.min_duration_minutes = preferences.min_duration_minutes
         db_preferences.max_duration_minutes = preferences.max_duration_minutes
-        db_preferences.preferred_languages = json.dumps(normalized_languages, ensure_ascii=False) if normalized_languages else None
+        db_preferences.preferred_languages = _normalize(preferences.preferred_languages)
         db_preferences.exclude_explicit_content = preferences.exclude_explicit_content
         db_preferences.educational_preference = preferences.educational_preference
         db_preferences.entertainment_preference = preferences.entertainment_preference
         
         db.commit()
-        db.refresh(db_preferences)
     
     return db_preferences
 
-# Функция для преобразования данных из базы в схему Pydantic
+# Функция для преобразования данных из базы в словарь по схеме PreferencesResponse.
+# Данные из базы уже проверены при записи, поэтому модель Pydantic не строим
 def preferences_to_schema(db_preferences):
     if not db_preferences:
         return None
     
-    def parse_list(value):
-        if not value:
-            return []
-        try:
-            # Пытаемся распарсить как JSON
-            return json.loads(value)
-        except json.JSONDecodeError:
-            # Если это строка с запятыми, разбиваем и нормализуем
-            if isinstance(value, str):
-                # Убираем квадратные скобки если есть и разбиваем
-                clean_value = value.replace('[', '').replace(']', '').replace("'", "").replace('"', '')
-                items = [item.strip() for item in clean_value.split(',') if item.strip()]
-                # Нормализуем каждый элемент
-                return [item for item in items]
-            return []
-    
-    preferred_categories = parse_list(db_preferences.preferred_categories)
-    preferred_languages = parse_list(db_preferences.preferred_languages)
-    
-    return schemas.PreferencesResponse(
-        id=db_preferences.id,
-        user_id=db_preferences.user_id,
-        preferred_categories=preferred_categories,
-        min_duration_minutes=db_preferences.min_duration_minutes,
-        max_duration_minutes=db_preferences.max_duration_minutes,
-        preferred_languages=preferred_languages,
-        exclude_explicit_content=db_preferences.exclude_explicit_content,
-        educational_preference=db_preferences.educational_preference,
-        entertainment_preference=db_preferences.entertainment_preference,
-        created_at=db_preferences.created_at,
-        updated_at=db_preferences.updated_at
-    )
\ No newline at end of file
+    # Списки хранятся в JSON-колонках, драйвер сразу возвращает list
+    return {
+        "id": db_preferences.id,
+        "user_id": db_preferences.user_id,
+        "preferred_categories": db_preferences.preferred_categories or [],
+        "min_duration_minutes": db_preferences.min_duration_minutes,
+        "max_duration_minutes": db_preferences.max_duration_minutes,
+        "preferred_languages": db_preferences.preferred_languages or [],
+        "exclude_explicit_content": db_preferences.exclude_explicit_content,
+        "educational_preference": db_preferences.educational_preference,
+        "entertainment_preference": db_preferences.entertainment_preference,
+        "created_at": db_preferences.created_at,
+        "updated_at": db_preferences.updated_at
+    }
\ No newline at end of file
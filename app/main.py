@@ -2,21 +2,36 @@ from fastapi import FastAPI, Depends, HTTPException, status, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Dict, Any
-import uuid
+from functools import lru_cache
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+import secrets
+import logging
 
 from app.database import get_db, engine
 from app import models, schemas, crud
+from app.sessions import SessionStore, UserCtx, session_payload, SESSION_TTL_SECONDS
 from app.services.video_analyzer import VideoAnalyzer
 
+# Один обработчик логов на процесс; подробный вывод анализатора - на уровне DEBUG
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Video Preferences API", version="1.0.0")
+app = FastAPI(title="Video Preferences API", version="1.0.0", default_response_class=ORJSONResponse)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+# Шаблоны компилируются один раз: без проверки mtime на каждый рендер
+# и с кешем байткода, общим для всех воркеров
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader("app/templates"),
+    autoescape=select_autoescape(),
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache()
+))
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,55 +41,87 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-video_analyzer = VideoAnalyzer()
+@lru_cache(maxsize=1)
+def get_video_analyzer() -> VideoAnalyzer:
+    # Один экземпляр анализатора на процесс, создается при старте приложения
+    return VideoAnalyzer()
+
+@app.on_event("startup")
+async def warm_video_analyzer():
+    get_video_analyzer()
+
+@app.on_event("shutdown")
+async def close_video_analyzer():
+    await get_video_analyzer().aclose()
+
+# Хранилище сессий: Redis (REDIS_URL) или локальный словарь для разработки
+session_store = SessionStore()
 
-# Хранилище сессий (в продакшене используйте Redis или базу данных)
-user_sessions = {}
+@app.on_event("startup")
+async def connect_session_store():
+    await session_store.connect()
+
+@app.on_event("shutdown")
+async def close_session_store():
+    await session_store.close()
+
+async def create_session(response: Response, user):
+    session_id = secrets.token_urlsafe(24)
+    await session_store.set(session_id, session_payload(user))
+    
+    # Устанавливаем cookie
+    response.set_cookie(
+        key="session_id",
+        value=session_id,
+        httponly=True,
+        max_age=SESSION_TTL_SECONDS
+    )
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+async def get_current_user(request: Request, db: Session = Depends(get_db)):
     session_id = request.cookies.get("session_id")
-    if session_id and session_id in user_sessions:
-        user_id = user_sessions[session_id]
-        user = crud.get_user_by_id(db, user_id)
-        if user:
-            return user
-    return None
+    if not session_id:
+        return None
+    
+    payload = await session_store.get(session_id)
+    if payload is None:
+        return None
+    
+    if "email" in payload and "username" in payload:
+        return UserCtx(payload["user_id"], payload["email"], payload["username"])
+    
+    # В сессии нет данных пользователя - загружаем из базы и сохраняем
+    user = crud.get_user_by_id(db, payload["user_id"])
+    if not user:
+        return None
+    await session_store.set(session_id, session_payload(user))
+    return UserCtx(user.id, user.email, user.username)
 
 @app.post("/register")
-def register(user: schemas.UserCreate, response: Response, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
+async def register(user: schemas.UserCreate, response: Response, db: Session = Depends(get_db)):
+    email_taken, username_taken = crud.check_user_conflicts(db, email=user.email, username=user.username)
+    if email_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    db_user = crud.get_user_by_username(db, username=user.username)
-    if db_user:
+    if username_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already taken"
         )
     
-    new_user = crud.create_user(db=db, user=user)
+    # Хеширование пароля выполняется в пуле потоков, чтобы не блокировать event loop
+    new_user = await run_in_threadpool(crud.create_user, db=db, user=user)
     
     # Создаем сессию
-    session_id = str(uuid.uuid4())
-    user_sessions[session_id] = new_user.id
-    
-    # Устанавливаем cookie
-    response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        max_age=3600  # 1 час
-    )
+    await create_session(response, new_user)
     
     return {"message": "Registration successful", "user_id": new_user.id}
 
 @app.post("/login")
-def login(user: schemas.UserLogin, response: Response, db: Session = Depends(get_db)):
-    authenticated_user = crud.authenticate_user(db, user.email, user.password)
+async def login(user: schemas.UserLogin, response: Response, db: Session = Depends(get_db)):
+    authenticated_user = await run_in_threadpool(crud.authenticate_user, db, user.email, user.password)
     if not authenticated_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -82,24 +129,15 @@ def login(user: schemas.UserLogin, response: Response, db: Session = Depends(get
         )
     
     # Создаем сессию
-    session_id = str(uuid.uuid4())
-    user_sessions[session_id] = authenticated_user.id
-    
-    # Устанавливаем cookie
-    response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        max_age=3600  # 1 час
-    )
+    await create_session(response, authenticated_user)
     
     return {"message": "Login successful", "user_id": authenticated_user.id}
 
 @app.post("/logout")
-def logout(response: Response, request: Request):
+async def logout(response: Response, request: Request):
     session_id = request.cookies.get("session_id")
-    if session_id and session_id in user_sessions:
-        del user_sessions[session_id]
+    if session_id:
+        await session_store.delete(session_id)
     
     # Удаляем cookie
     response.delete_cookie("session_id")
@@ -109,7 +147,7 @@ def logout(response: Response, request: Request):
 def get_user_preferences(
     user_id: int, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: UserCtx = Depends(get_current_user)
 ):
     if not current_user or current_user.id != user_id:
         raise HTTPException(
@@ -124,15 +162,15 @@ def get_user_preferences(
             detail="Preferences not found for this user"
         )
     
-    # Используем функцию преобразования
-    return crud.preferences_to_schema(preferences)
+    # Отдаем словарь напрямую через orjson, минуя валидацию по response_model
+    return ORJSONResponse(crud.preferences_to_schema(preferences))
 
 @app.post("/users/{user_id}/preferences", response_model=schemas.PreferencesResponse)
 def create_or_update_preferences(
     user_id: int,
     preferences: schemas.PreferencesCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: UserCtx = Depends(get_current_user)
 ):
     if not current_user or current_user.id != user_id:
         raise HTTPException(
@@ -140,7 +178,7 @@ def create_or_update_preferences(
             detail="Not authenticated"
         )
     
-    user = crud.get_user(db, user_id)
+    user = crud.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -154,14 +192,18 @@ def create_or_update_preferences(
     else:
         result = crud.create_user_preferences(db, preferences, user_id)
     
-    # Используем функцию преобразования для ответа
-    return crud.preferences_to_schema(result)
+    # Используем функцию преобразования для ответа (без повторной валидации)
+    return ORJSONResponse(crud.preferences_to_schema(result))
+
+# Ограничение пакетного анализа: каждое видео скачивается и транскрибируется
+MAX_VIDEOS_PER_REQUEST = 20
 
 @app.post("/analyze-video")
 async def analyze_video(
     request: Dict[str, Any], 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: UserCtx = Depends(get_current_user),
+    video_analyzer: VideoAnalyzer = Depends(get_video_analyzer)
 ):
     if not current_user:
         raise HTTPException(
@@ -179,7 +221,7 @@ async def analyze_video(
         )
     
     try:
-        analysis_result = video_analyzer.analyze_video_suitability(video_url, user_preferences)
+        analysis_result = await video_analyzer.analyze_video_suitability(video_url, user_preferences)
         return analysis_result
     except Exception as e:
         raise HTTPException(
@@ -187,10 +229,45 @@ async def analyze_video(
             detail=f"Error analyzing video: {str(e)}"
         )
 
+@app.post("/analyze-videos")
+async def analyze_videos(
+    request: Dict[str, Any],
+    current_user: UserCtx = Depends(get_current_user),
+    video_analyzer: VideoAnalyzer = Depends(get_video_analyzer)
+):
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated"
+        )
+    
+    video_urls = request.get("video_urls")
+    user_preferences = request.get("user_preferences", {})
+    
+    if not video_urls or not isinstance(video_urls, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Video URLs are required"
+        )
+    if len(video_urls) > MAX_VIDEOS_PER_REQUEST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_VIDEOS_PER_REQUEST} videos per request"
+        )
+    
+    try:
+        results = await video_analyzer.analyze_batch([str(url) for url in video_urls], user_preferences)
+        return {"results": results}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error analyzing videos: {str(e)}"
+        )
+
 # Template Routes
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request, db: Session = Depends(get_db)):
-    current_user = get_current_user(request, db)
+    current_user = await get_current_user(request, db)
     return templates.TemplateResponse("index.html", {
         "request": request,
         "current_user": current_user
@@ -198,7 +275,7 @@ async def index(request: Request, db: Session = Depends(get_db)):
 
 @app.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request, db: Session = Depends(get_db)):
-    current_user = get_current_user(request, db)
+    current_user = await get_current_user(request, db)
     if current_user:
         return RedirectResponse(url="/", status_code=303)
     return templates.TemplateResponse("register.html", {
@@ -208,7 +285,7 @@ async def register_page(request: Request, db: Session = Depends(get_db)):
 
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, db: Session = Depends(get_db)):
-    current_user = get_current_user(request, db)
+    current_user = await get_current_user(request, db)
     if current_user:
         return RedirectResponse(url="/", status_code=303)
     return templates.TemplateResponse("login.html", {
@@ -218,11 +295,11 @@ async def login_page(request: Request, db: Session = Depends(get_db)):
 
 @app.get("/users/{user_id}/preferences-page", response_class=HTMLResponse)
 async def get_preferences_page(request: Request, user_id: int, db: Session = Depends(get_db)):
-    current_user = get_current_user(request, db)
+    current_user = await get_current_user(request, db)
     if not current_user or current_user.id != user_id:
         return RedirectResponse(url="/login", status_code=303)
     
-    user = crud.get_user(db, user_id)
+    user = crud.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -234,7 +311,7 @@ async def get_preferences_page(request: Request, user_id: int, db: Session = Dep
 
 @app.get("/analyze", response_class=HTMLResponse)
 async def analyze_video_page(request: Request, db: Session = Depends(get_db)):
-    current_user = get_current_user(request, db)
+    current_user = await get_current_user(request, db)
     if not current_user:
         return RedirectResponse(url="/login", status_code=303)
     
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
 
 class User(Base):
     __tablename__ = "users"
+    # Серверные значения (created_at) возвращаются через RETURNING в том же INSERT
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String(255), unique=True, index=True, nullable=False)
@@ -16,14 +18,15 @@ class User(Base):
 
 class UserPreferences(Base):
     __tablename__ = "user_preferences"
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, index=True, nullable=False)
     
-    preferred_categories = Column(Text)
+    preferred_categories = Column(JSON(none_as_null=True))
     min_duration_minutes = Column(Integer, default=0)
     max_duration_minutes = Column(Integer, default=120)
-    preferred_languages = Column(Text)
+    preferred_languages = Column(JSON(none_as_null=True))
     exclude_explicit_content = Column(Boolean, default=False)
     educational_preference = Column(Boolean, default=False)
     entertainment_preference = Column(Boolean, default=True)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, ConfigDict, EmailStr, StrictBool, StrictFloat, field_validator
 from typing import Optional, List
 from datetime import datetime
 
@@ -9,7 +9,8 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
     
-    @validator('password')
+    @field_validator('password')
+    @classmethod
     def password_strength(cls, v):
         if len(v) < 6:
             raise ValueError('Password must be at least 6 characters long')
@@ -23,8 +24,7 @@ class UserResponse(UserBase):
     id: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PreferencesBase(BaseModel):
     preferred_categories: Optional[List[str]] = None
@@ -44,9 +44,40 @@ class PreferencesResponse(PreferencesBase):
     created_at: datetime
     updated_at: Optional[datetime]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class VideoAnalysisRequest(BaseModel):
     video_url: str
-    user_preferences: dict
\ No newline at end of file
+    user_preferences: dict
+
+class MistralResult(BaseModel):
+    """
+    Ответ Mistral для анализа видео. Уверенность и оценка приводятся
+    к допустимому диапазону, а не отклоняются
+    """
+    is_suitable: StrictBool
+    analysis: str
+    confidence: StrictFloat
+    reasons: List[str]
+    match_score: int
+    detected_topics: List[str] = []
+    content_type: str = 'unknown'
+    language_detected: str = 'unknown'
+    
+    @field_validator('confidence')
+    @classmethod
+    def clamp_confidence(cls, v):
+        return max(0.0, min(1.0, v))
+    
+    @field_validator('match_score', mode='before')
+    @classmethod
+    def clamp_match_score(cls, v):
+        # Числа строкой ("55") не принимаются, как и раньше
+        if isinstance(v, str):
+            raise ValueError('match_score must be a number')
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return max(0, min(100, int(v)))
+        return v
+
+class MistralBatchItem(MistralResult):
+    index: int
@@ -1,50 +1,446 @@
 import os
+import re
+import logging
 import json
+import time
+import asyncio
+import atexit
+import queue
+import hashlib
+import random
 import tempfile
-import librosa
-import requests
-from typing import Dict, Any
+import threading
+import ahocorasick
+import ctranslate2
+import diskcache
+import httpx
+import numpy
+import orjson
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+from collections import deque, defaultdict
+from cachetools import TTLCache
 from yt_dlp import YoutubeDL
-from whisper import load_model
+from faster_whisper import WhisperModel
+from pydantic import ValidationError
+
+from app.schemas import MistralResult, MistralBatchItem
+
+log = logging.getLogger(__name__)
+
+YOUTUBE_OEMBED_URL = "https://www.youtube.com/oembed"
+YOUTUBE_WATCH_URL = "https://www.youtube.com/watch?v="
+# ID видео в ссылках youtube.com/watch?v=, youtu.be/, /shorts/, /embed/, /live/
+_YT_ID_RE = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:\S*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])"
+)
+# Начало JSON с данными плеера на странице просмотра YouTube
+_PLAYER_RESPONSE_RE = re.compile(r"ytInitialPlayerResponse\s*=\s*\{")
+
+# Группы ключевых слов для fallback-анализа
+FALLBACK_KEYWORDS = {
+    'explicit': ('мат', 'ругательство', 'оскорбление', 'порно', 'секс', 'насилие'),
+    'educational': ('обучение', 'урок', 'курс', 'лекция', 'образование'),
+    'entertainment': ('развлечение', 'юмор', 'смех', 'прикол', 'комедия'),
+}
+
+# Коды причин fallback-анализа; тексты собираются один раз в конце анализа
+REASON_CONTENT_SHORT = 0
+REASON_CONTENT_OK = 1
+REASON_TOPICS_FOUND = 2
+REASON_TOPICS_MISSING = 3
+REASON_EXPLICIT = 4
+
+_REASON_MESSAGES = {
+    REASON_CONTENT_SHORT: "Слишком мало контента ({word_count} слов)",
+    REASON_CONTENT_OK: "Достаточный объем контента ({word_count} слов)",
+    REASON_TOPICS_FOUND: "Найдены тематики: {topics}",
+    REASON_TOPICS_MISSING: "Тематики не соответствуют предпочтениям",
+    REASON_EXPLICIT: "Обнаружен нежелательный контент",
+}
+
+# Грубая оценка токенов Mistral для русского текста: ~3 символа на токен
+_CHARS_PER_TOKEN = 3
+
+_URL_RE = re.compile(r"https?://\S+")
+_WS_RE = re.compile(r"\s+")
+
+_SYSTEM_PROMPT = "Ты анализируешь YouTube видео только по транскрипции. Отвечай только JSON."
+
+# Фиксированная часть промпта для Mistral: короче промпт - меньше токенов и задержка
+_PROMPT_TEMPLATE = (
+    "Оцени по транскрипции YouTube видео, подходит ли оно пользователю. Анализируй только этот текст.\n"
+    "ТРАНСКРИПЦИЯ ({word_count} слов):\n{transcription}\n"
+    "ПРЕДПОЧТЕНИЯ:\n{preferences}\n"
+    "Критерии: объем (минимум {min_content_length} слов), тематика, тип контента, язык, нежелательный контент.\n"
+    'Ответ - только JSON: {{"is_suitable": bool, "analysis": "анализ на русском", "confidence": 0..1, '
+    '"reasons": [строки], "match_score": 0..100, "detected_topics": [строки], '
+    '"content_type": "educational|entertainment|mixed|unknown", "language_detected": "русский|английский|другой"}}'
+)
+
+# Пакетный промпт: общие инструкции и предпочтения один раз на несколько видео
+_BATCH_PROMPT_TEMPLATE = (
+    "Оцени по транскрипциям YouTube видео, подходит ли каждое из них пользователю. Анализируй только эти тексты.\n"
+    "{videos}\n"
+    "ПРЕДПОЧТЕНИЯ:\n{preferences}\n"
+    "Критерии: объем (минимум {min_content_length} слов), тематика, тип контента, язык, нежелательный контент.\n"
+    'Ответ - только JSON: {{"results": [{{"index": номер видео, "is_suitable": bool, "analysis": "анализ на русском", '
+    '"confidence": 0..1, "reasons": [строки], "match_score": 0..100, "detected_topics": [строки], '
+    '"content_type": "educational|entertainment|mixed|unknown", "language_detected": "русский|английский|другой"}}]}}'
+)
+_BATCH_VIDEO_TEMPLATE = "ВИДЕО {index} ({word_count} слов):\n{transcription}"
+
+# Сколько видео отправлять в Mistral одним запросом
+MISTRAL_BATCH_SIZE = 8
+
+# Сворачивание символов после lower(): "ё" и "е" считаются одной буквой
+_FOLD_TABLE = str.maketrans({'ё': 'е'})
+
+def normalize_text(text: str) -> str:
+    return text.lower().translate(_FOLD_TABLE)
+
+def extract_video_id(video_url: str) -> Optional[str]:
+    match = _YT_ID_RE.search(video_url)
+    return match.group(1) if match else None
+
+def build_keyword_automaton() -> ahocorasick.Automaton:
+    """
+    Автомат Ахо-Корасик по всем ключевым словам: один линейный проход по тексту
+    вместо отдельного поиска подстроки для каждого слова
+    """
+    automaton = ahocorasick.Automaton()
+    for group, keywords in FALLBACK_KEYWORDS.items():
+        for keyword in keywords:
+            automaton.add_word(normalize_text(keyword), (group, keyword))
+    automaton.make_automaton()
+    return automaton
+
+def build_category_automaton(categories: List[str]) -> Optional[ahocorasick.Automaton]:
+    """
+    Автомат по тематикам пользователя: все тематики ищутся за один проход.
+    None - если искать нечего
+    """
+    automaton = ahocorasick.Automaton()
+    for category in categories:
+        key = normalize_text(category)
+        if key:
+            automaton.add_word(key, key)
+    if len(automaton) == 0:
+        return None
+    automaton.make_automaton()
+    return automaton
+
+class JsonObjectScanner:
+    """
+    Инкрементально находит конец первого JSON-объекта в потоке текста
+    (счетчик скобок с учетом строк и экранирования)
+    """
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.start = None
+        self.end = None
+    
+    def feed(self, chunk: str) -> bool:
+        self.parts.append(chunk)
+        offset = self.length
+        self.length += len(chunk)
+        for index, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.depth > 0
+            elif char == '{':
+                if self.depth == 0:
+                    self.start = offset + index
+                self.depth += 1
+            elif char == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = offset + index + 1
+                    return True
+        return False
+    
+    def text(self) -> str:
+        text = "".join(self.parts)
+        if self.end is None:
+            return text
+        return text[self.start:self.end]
+
+class TokenBucket:
+    """
+    Ограничитель скорости: пополняется на rate токенов в секунду, в запасе
+    не больше capacity. acquire ждет, пока токенов не станет достаточно
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, tokens: float = 1):
+        tokens = min(tokens, self.capacity)
+        # Ожидающие обслуживаются по очереди, чтобы большой запрос не голодал
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+    
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Берет токены без ожидания. False, если их не хватает или уже есть очередь
+        """
+        tokens = min(tokens, self.capacity)
+        if self._lock.locked():
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+def _retry_after_seconds(value: Optional[str], default: float = 1.0) -> float:
+    try:
+        return min(max(float(value), 0.0), 30.0)
+    except (TypeError, ValueError):
+        return default
 
 class VideoAnalyzer:
+    # Модель Whisper общая для всех экземпляров и загружается при первой транскрибации
+    _whisper_model = None
+    _whisper_lock = threading.Lock()
+    
     def __init__(self):
         self.mistral_api_key = os.getenv("MISTRAL_API_KEY")
         self.mistral_api_url = "https://api.mistral.ai/v1/chat/completions"
         
+        # Общий HTTP-клиент: соединения переиспользуются между запросами,
+        # по HTTP/2 запросы к одному хосту идут по одному TLS-соединению
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        )
+        
+        # Hedging: если Mistral не ответил за ~P95 задержки, отправляем второй
+        # такой же запрос и берем первый пришедший ответ. MISTRAL_HEDGING=0 отключает
+        self.hedging_enabled = os.getenv("MISTRAL_HEDGING", "1") != "0"
+        self.default_hedge_delay = 4.0
+        self._mistral_latencies = deque(maxlen=200)
+        
+        # Ограничения Mistral на процесс: число одновременных запросов,
+        # запросы в минуту и токены в минуту. Лишние запросы ждут, а не получают 429
+        rpm = int(os.getenv("MISTRAL_RPM", "60"))
+        tpm = int(os.getenv("MISTRAL_TPM", "500000"))
+        self._mistral_semaphore = asyncio.Semaphore(int(os.getenv("MISTRAL_MAX_CONCURRENCY", "8")))
+        self._mistral_requests = TokenBucket(rate=rpm / 60, capacity=rpm)
+        self._mistral_tokens = TokenBucket(rate=tpm / 60, capacity=tpm)
+        # После 429 ни один запрос (включая hedging) не уходит раньше этого момента
+        self._mistral_not_before = 0.0
+        
+        # Кеши в памяти процесса: метаданные видео по ID и готовые результаты
+        # анализа по (видео, предпочтения). Одинаковые запросы, пришедшие
+        # одновременно, ждут одну общую задачу (single-flight)
+        self._video_info_cache = TTLCache(maxsize=1024, ttl=3600)
+        self._analysis_cache = TTLCache(maxsize=5000, ttl=1800)
+        self._analysis_inflight = {}
+        
+        # Транскрипции на диске по ID видео: переживают перезапуск и общие
+        # для всех воркеров, повторное видео не скачивается и не транскрибируется
+        self._transcript_cache = diskcache.Cache(
+            os.getenv("TRANSCRIPT_CACHE_DIR", os.path.join("cache", "transcripts")),
+            eviction_policy='least-recently-used'
+        )
+        # Ответы Mistral по хешу промпта: одинаковый текст и предпочтения - без запроса к API
+        self._mistral_cache = diskcache.Cache(
+            os.getenv("MISTRAL_CACHE_DIR", os.path.join("cache", "mistral")),
+            eviction_policy='least-recently-used'
+        )
+        self.mistral_cache_ttl = 86400
+        
+        self._keyword_automaton = build_keyword_automaton()
+        
+        # Один экземпляр YoutubeDL для метаданных: экстракторы и cookie-файл
+        # загружаются один раз. YoutubeDL не потокобезопасен, поэтому под замком
+        self._info_ydl = YoutubeDL({
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+            'cookiefile': 'cookies.txt',
+        })
+        self._info_ydl_lock = threading.Lock()
+        
+        # Небольшой пул YoutubeDL для скачивания аудио: экземпляр берется
+        # из очереди на время одной загрузки и возвращается обратно
+        self._download_ydls = queue.Queue()
+        for _ in range(int(os.getenv("YTDLP_DOWNLOADERS", "4"))):
+            # Аудио сохраняется в исходном контейнере (webm/m4a) без перекодирования
+            # в mp3: faster-whisper сам декодирует и ресемплирует его за один проход
+            self._download_ydls.put(YoutubeDL({
+                'quiet': True,
+                'format': 'bestaudio/best',
+                'cookiefile': 'cookies.txt',
+                'ffmpeg_location': r'C:\ffmpeg\bin',
+            }))
+        # Если aclose не вызовут (например, при аварийной остановке), cookie-файлы
+        # и соединения yt-dlp все равно закроются при выходе
+        atexit.register(self._close_ytdlp)
+        
         # Добавляем FFmpeg в PATH
         ffmpeg_path = r'C:\ffmpeg\bin'
         if ffmpeg_path not in os.environ['PATH']:
             os.environ['PATH'] = ffmpeg_path + os.pathsep + os.environ['PATH']
         
         if self.mistral_api_key and self.mistral_api_key != "your-mistral-api-key-here":
-            print("✅ Mistral AI client initialized successfully")
+            log.info("Mistral AI client initialized")
         else:
-            print("❌ Mistral API key not found or not configured")
+            log.warning("Mistral API key not found or not configured")
+    
+    @classmethod
+    def _get_model(cls) -> WhisperModel:
+        if cls._whisper_model is None:
+            with cls._whisper_lock:
+                # Повторная проверка: модель мог загрузить другой поток, пока мы ждали
+                if cls._whisper_model is None:
+                    cls._whisper_model = cls._load_whisper()
+        return cls._whisper_model
+    
+    @staticmethod
+    def _load_whisper() -> WhisperModel:
+        # На GPU (CUDA) - float16, иначе CPU с int8-квантованием
+        if ctranslate2.get_cuda_device_count() > 0:
+            try:
+                model = WhisperModel("base", device="cuda", compute_type="float16")
+                # Без cuBLAS/cuDNN модель создается, но падает на первом encode -
+                # проверяем пробной транскрипцией секунды тишины
+                segments, _ = model.transcribe(numpy.zeros(16000, dtype=numpy.float32))
+                list(segments)
+                log.info("Whisper model loaded on CUDA (float16)")
+                return model
+            except Exception as e:
+                log.warning("Whisper is unusable on CUDA, falling back to CPU: %s", e)
+        return WhisperModel("base", device="cpu", compute_type="int8", cpu_threads=os.cpu_count())
+    
+    async def aclose(self):
+        await self.http_client.aclose()
+        self._transcript_cache.close()
+        self._mistral_cache.close()
+        self._close_ytdlp()
     
-    def _get_video_info(self, video_url: str) -> Dict[str, Any]:
+    def _close_ytdlp(self):
+        self._info_ydl.close()
+        while True:
+            try:
+                self._download_ydls.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    async def _lookup_video_info(self, video_id: str, video_url: str) -> Optional[Dict[str, Any]]:
         """
-        Получает базовую информацию о видео
+        Метаданные из кеша или быстрым путем без yt-dlp. None - если не удалось
+        """
+        video_info = self._video_info_cache.get(video_id)
+        if video_info is not None:
+            return video_info
+        
+        video_info = await self._fast_extract(video_url)
+        if video_info is not None:
+            self._video_info_cache[video_id] = video_info
+        return video_info
+    
+    async def _video_info_after_download(self, video_id: str, video_url: str, transcription_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Метаданные видео после загрузки аудио. yt-dlp уже вернул их вместе с аудио
+        (они же лежат в кеше транскрипций), поэтому запросы к YouTube за
+        метаданными идут только если загрузка не удалась
+        """
+        ytdlp_info = transcription_result.get('video_info')
+        video_info = None
+        if ytdlp_info is None:
+            video_info = await self._lookup_video_info(video_id, video_url)
+        if video_info is None:
+            video_info = await self._resolve_video_info(video_id, video_url, ytdlp_info)
+        return video_info
+    
+    async def _resolve_video_info(self, video_id: str, video_url: str, ytdlp_info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Метаданные, когда быстрый путь не сработал: берутся из загрузки аудио,
+        отдельный запрос к yt-dlp - только если их там нет
+        """
+        video_info = ytdlp_info
+        if video_info is None:
+            # yt-dlp блокирующий - выполняем в отдельном потоке
+            video_info = await asyncio.to_thread(self._extract_video_info, video_url)
+        if video_info.get('success'):
+            self._video_info_cache[video_id] = video_info
+        return video_info
+    
+    async def _fast_extract(self, video_url: str) -> Optional[Dict[str, Any]]:
+        """
+        Быстрое получение метаданных без yt-dlp: oEmbed + ytInitialPlayerResponse
+        со страницы просмотра (два параллельных запроса). None - если не удалось
         """
         try:
-            ydl_opts = {
-                'quiet': True,
-                'cookiefile': 'cookies.txt',
-            }
+            oembed_response, page_response = await asyncio.gather(
+                self.http_client.get(YOUTUBE_OEMBED_URL, params={'url': video_url, 'format': 'json'}),
+                self.http_client.get(video_url, headers={'Accept-Language': 'ru,en;q=0.8'}, follow_redirects=True)
+            )
+            if oembed_response.status_code != 200 or page_response.status_code != 200:
+                return None
             
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(video_url, download=False)
-                return {
-                    'title': info.get('title', 'Unknown Title'),
-                    'uploader': info.get('uploader', 'Unknown Uploader'),
-                    'duration': info.get('duration', 0),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'view_count': info.get('view_count', 0),
-                    'description': info.get('description', ''),
-                    'success': True
-                }
+            oembed = oembed_response.json()
+            page = page_response.text
+            match = _PLAYER_RESPONSE_RE.search(page)
+            if not match:
+                return None
+            player_response, _ = json.JSONDecoder().raw_decode(page, match.end() - 1)
+            details = player_response.get('videoDetails') or {}
+            if not details:
+                return None
+            
+            return {
+                'title': oembed.get('title') or details.get('title', 'Unknown Title'),
+                'uploader': oembed.get('author_name') or details.get('author', 'Unknown Uploader'),
+                'duration': int(details.get('lengthSeconds') or 0),
+                'thumbnail': oembed.get('thumbnail_url', ''),
+                'view_count': int(details.get('viewCount') or 0),
+                'description': details.get('shortDescription', ''),
+                'success': True
+            }
         except Exception as e:
-            print(f"❌ Error getting video info: {e}")
+            log.warning("Fast video info extraction failed, falling back to yt-dlp: %s", e)
+            return None
+    
+    @staticmethod
+    def _preferences_hash(user_preferences: Dict[str, Any]) -> str:
+        serialized = orjson.dumps(user_preferences, option=orjson.OPT_SORT_KEYS, default=str)
+        return hashlib.blake2b(serialized, digest_size=16).hexdigest()
+    
+    def _extract_video_info(self, video_url: str) -> Dict[str, Any]:
+        """
+        Получает базовую информацию о видео
+        """
+        try:
+            with self._info_ydl_lock:
+                info = self._info_ydl.extract_info(video_url, download=False)
+            return self._video_info_from_ytdlp(info)
+        except Exception as e:
+            log.error("Error getting video info: %s", e)
             return {
                 'title': 'Unknown Title',
                 'uploader': 'Unknown Uploader',
@@ -54,59 +450,284 @@ class VideoAnalyzer:
                 'success': False
             }
     
-    def analyze_video_suitability(self, video_url: str, user_preferences: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def _video_info_from_ytdlp(info: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'title': info.get('title', 'Unknown Title'),
+            'uploader': info.get('uploader', 'Unknown Uploader'),
+            'duration': info.get('duration', 0),
+            'thumbnail': info.get('thumbnail', ''),
+            'view_count': info.get('view_count', 0),
+            'description': info.get('description', ''),
+            'success': True
+        }
+    
+    async def analyze_video_suitability(self, video_url: str, user_preferences: Dict[str, Any]) -> Dict[str, Any]:
         """
         Основной метод анализа видео на соответствие предпочтениям пользователя
-        через транскрибацию аудио
+        через транскрибацию аудио (с кешированием результата)
         """
-        print(f"🔍 Analyzing video: {video_url}")
-        print(f"📊 User preferences: {user_preferences}")
+        # Ссылки не на YouTube отклоняем до любых сетевых запросов
+        video_id = extract_video_id(video_url)
+        if video_id is None:
+            return self._error_result("Invalid YouTube URL")
+        # Разные формы ссылки на одно видео сводятся к одной, кеш - по ID видео
+        video_url = YOUTUBE_WATCH_URL + video_id
         
-        # Получаем информацию о видео
-        video_info = self._get_video_info(video_url)
+        key = (video_id, self._preferences_hash(user_preferences))
+        cached = self._analysis_cache.get(key)
+        if cached is not None:
+            log.debug("Using cached analysis for %s", video_url)
+            return cached
         
-        # Транскрибируем аудио видео
-        print("🎵 Starting audio transcription...")
-        transcription_result = self._download_and_transcribe_audio(video_url)
+        task = self._analysis_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._analyze_video(video_id, video_url, user_preferences))
+            self._analysis_inflight[key] = task
+            task.add_done_callback(lambda finished: self._store_analysis(key, finished))
+        # shield: отмена одного из ожидающих запросов не отменяет общий анализ
+        result, _ = await asyncio.shield(task)
+        return result
+    
+    def _store_analysis(self, key, task: asyncio.Task):
+        self._analysis_inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result, cacheable = task.result()
+        if cacheable:
+            self._analysis_cache[key] = result
+    
+    async def analyze_batch(self, video_urls: List[str], user_preferences: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Анализ нескольких видео: скачивание аудио идет параллельно с транскрибацией
+        предыдущего, в Mistral уходит один запрос на каждые MISTRAL_BATCH_SIZE видео.
+        Результаты возвращаются в порядке ссылок
+        """
+        preferences_hash = self._preferences_hash(user_preferences)
+        results = [None] * len(video_urls)
+        # video_id -> позиции в списке ссылок (одно видео могут прислать дважды)
+        pending = {}
+        for position, video_url in enumerate(video_urls):
+            video_id = extract_video_id(video_url)
+            if video_id is None:
+                results[position] = self._error_result("Invalid YouTube URL")
+                continue
+            cached = self._analysis_cache.get((video_id, preferences_hash))
+            if cached is not None:
+                results[position] = cached
+                continue
+            pending.setdefault(video_id, []).append(position)
         
-        if not transcription_result.get('success', False):
-            error_msg = f"Failed to transcribe audio: {transcription_result.get('error')}"
-            print(f"❌ {error_msg}")
-            return {
-                'success': False,
-                'error': error_msg,
-                'is_suitable': False,
-                'video_info': video_info  # Все равно возвращаем информацию о видео
-            }
+        video_ids = list(pending)
         
-        transcription = transcription_result['transcription']
-        print(f"📝 Transcription completed ({len(transcription)} characters)")
+        # Конвейер: пока Whisper транскрибирует одно видео, скачивается следующее.
+        # Очередь на 2 элемента не дает загрузкам сильно обогнать транскрибацию
+        downloads = asyncio.Queue(maxsize=2)
+        transcription_results = {}
+        word_counts = {}
+        # Слишком короткие транскрипции в Mistral не отправляются
+        short_transcriptions = []
+        mistral_batches = []
+        mistral_tasks = []
+        batch = []
         
-        # Анализируем через Mistral AI
-        mistral_result = self._analyze_with_mistral(transcription, user_preferences, video_url)
-        if mistral_result:
-            print("✅ Using Mistral AI analysis")
-            return {
-                'success': True,
-                'video_info': video_info,
-                'transcription_preview': transcription[:500] + "..." if len(transcription) > 500 else transcription,
-                'word_count': len(transcription.split()),
-                'analysis': mistral_result,
-                'is_suitable': mistral_result.get('is_suitable', False)
-            }
+        def send_batch():
+            mistral_batches.append(batch[:])
+            mistral_tasks.append(asyncio.ensure_future(self._analyze_batch_with_mistral(
+                [transcription for _, transcription in batch], user_preferences
+            )))
+            batch.clear()
         
-        # Fallback анализ
-        print("🔄 Using fallback analysis")
-        fallback_result = self._fallback_analysis(transcription, user_preferences)
+        async def download_stage():
+            for video_id in video_ids:
+                cached = await asyncio.to_thread(self._cached_transcription, video_id)
+                if cached is not None:
+                    await downloads.put((video_id, None, cached))
+                    continue
+                temp_dir = tempfile.TemporaryDirectory()
+                try:
+                    download_result = await asyncio.to_thread(self._download_audio, YOUTUBE_WATCH_URL + video_id, temp_dir.name)
+                    await downloads.put((video_id, temp_dir, download_result))
+                except BaseException:
+                    temp_dir.cleanup()
+                    raise
+            await downloads.put(None)
+        
+        async def transcribe_stage():
+            while True:
+                item = await downloads.get()
+                if item is None:
+                    break
+                video_id, temp_dir, transcription_result = item
+                if temp_dir is not None:
+                    try:
+                        if transcription_result['success']:
+                            ytdlp_info = transcription_result['video_info']
+                            transcription_result = await asyncio.to_thread(self._transcribe_file, transcription_result['audio_path'])
+                            transcription_result['video_info'] = ytdlp_info
+                            await asyncio.to_thread(self._remember_transcription, video_id, transcription_result)
+                    finally:
+                        temp_dir.cleanup()
+                
+                transcription_results[video_id] = transcription_result
+                if not transcription_result['success']:
+                    continue
+                transcription = transcription_result['transcription']
+                word_counts[video_id] = word_count = len(transcription.split())
+                if self._too_short_for_mistral(word_count, user_preferences):
+                    short_transcriptions.append((video_id, transcription))
+                    continue
+                # Полный пакет сразу уходит в Mistral, не дожидаясь остальных видео
+                batch.append((video_id, transcription))
+                if len(batch) == MISTRAL_BATCH_SIZE:
+                    send_batch()
+        
+        stages = [asyncio.ensure_future(download_stage()), asyncio.ensure_future(transcribe_stage())]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            # Сбой одной стадии (или отмена запроса) останавливает весь конвейер:
+            # вторая стадия и запросы в Mistral отменяются,
+            # временные каталоги из очереди удаляются
+            for task in (*stages, *mistral_tasks):
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            while not downloads.empty():
+                item = downloads.get_nowait()
+                if item is not None and item[1] is not None:
+                    item[1].cleanup()
+            raise
+        if batch:
+            send_batch()
+        
+        # Метаданные берутся из загрузки аудио; YouTube запрашивается только
+        # для видео, которые скачать не удалось
+        video_infos = dict(zip(video_ids, await asyncio.gather(*(
+            self._video_info_after_download(video_id, YOUTUBE_WATCH_URL + video_id, transcription_results[video_id])
+            for video_id in video_ids
+        ))))
+        batch_analyses = await asyncio.gather(*mistral_tasks)
+        
+        for video_id, transcription_result in transcription_results.items():
+            if transcription_result['success']:
+                continue
+            error_result = self._transcription_error(video_infos[video_id], transcription_result)
+            for position in pending[video_id]:
+                results[position] = error_result
+        
+        # Автомат тематик строится один раз на весь пакет
+        category_automaton = build_category_automaton(user_preferences.get('preferred_categories') or [])
+        # (видео, текст, ответ Mistral, можно ли кешировать итог)
+        analyzed = [
+            (video_id, transcription, mistral_result, mistral_result is not None)
+            for mistral_batch, analyses in zip(mistral_batches, batch_analyses)
+            for (video_id, transcription), mistral_result in zip(mistral_batch, analyses)
+        ]
+        # Для коротких текстов fallback - окончательный ответ, а не замена Mistral
+        analyzed.extend((video_id, transcription, None, True) for video_id, transcription in short_transcriptions)
+        
+        for video_id, transcription, mistral_result, cacheable in analyzed:
+            word_count = word_counts[video_id]
+            if mistral_result is None:
+                mistral_result = self._fallback_analysis(transcription, user_preferences, category_automaton, word_count)
+            result = self._analysis_result(video_infos[video_id], transcription, mistral_result, word_count)
+            if cacheable:
+                self._analysis_cache[(video_id, preferences_hash)] = result
+            for position in pending[video_id]:
+                results[position] = result
+        
+        return results
+    
+    async def _prepare_video(self, video_id: str, video_url: str):
+        # diskcache читает и пишет файлы - в поток, чтобы не блокировать event loop
+        transcription_result = await asyncio.to_thread(self._cached_transcription, video_id)
+        if transcription_result is None:
+            transcription_result = await asyncio.to_thread(self._download_and_transcribe_audio, video_url)
+            await asyncio.to_thread(self._remember_transcription, video_id, transcription_result)
+        
+        video_info = await self._video_info_after_download(video_id, video_url, transcription_result)
+        return video_info, transcription_result
+    
+    # Кеш транскрипций необязателен: ошибка диска не должна ломать анализ
+    def _cached_transcription(self, video_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self._transcript_cache.get(video_id)
+        except Exception as e:
+            log.warning("Transcript cache read failed: %s", e)
+            return None
+    
+    def _remember_transcription(self, video_id: str, transcription_result: Dict[str, Any]):
+        if not transcription_result.get('success'):
+            return
+        try:
+            self._transcript_cache.set(video_id, transcription_result)
+        except Exception as e:
+            log.warning("Transcript cache write failed: %s", e)
+    
+    @staticmethod
+    def _error_result(error: str, video_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        result = {
+            'success': False,
+            'error': error,
+            'is_suitable': False
+        }
+        if video_info is not None:
+            result['video_info'] = video_info  # Все равно возвращаем информацию о видео
+        return result
+    
+    def _transcription_error(self, video_info: Dict[str, Any], transcription_result: Dict[str, Any]) -> Dict[str, Any]:
+        error_msg = f"Failed to transcribe audio: {transcription_result.get('error')}"
+        log.error(error_msg)
+        return self._error_result(error_msg, video_info)
+    
+    @staticmethod
+    def _too_short_for_mistral(word_count: int, user_preferences: Dict[str, Any]) -> bool:
+        # Текст меньше половины минимального объема fallback отклонит и так,
+        # запрос к Mistral (несколько секунд) для него не нужен
+        return word_count < user_preferences.get('min_content_length', 100) // 2
+    
+    @staticmethod
+    def _analysis_result(video_info: Dict[str, Any], transcription: str, analysis: Dict[str, Any], word_count: int) -> Dict[str, Any]:
         return {
             'success': True,
             'video_info': video_info,
             'transcription_preview': transcription[:500] + "..." if len(transcription) > 500 else transcription,
-            'word_count': len(transcription.split()),
-            'analysis': fallback_result,
-            'is_suitable': fallback_result.get('is_suitable', False)
+            'word_count': word_count,
+            'analysis': analysis,
+            'is_suitable': analysis.get('is_suitable', False)
         }
     
+    async def _analyze_video(self, video_id: str, video_url: str, user_preferences: Dict[str, Any]):
+        """
+        Возвращает (результат, можно ли его кешировать). Fallback из-за сбоя
+        Mistral не кешируется, чтобы следующий запрос снова попробовал Mistral
+        """
+        log.debug("Analyzing video %s with preferences %s", video_url, user_preferences)
+        
+        # Получаем информацию о видео и транскрибируем аудио
+        video_info, transcription_result = await self._prepare_video(video_id, video_url)
+        if not transcription_result.get('success', False):
+            return self._transcription_error(video_info, transcription_result), False
+        
+        transcription = transcription_result['transcription']
+        word_count = len(transcription.split())
+        log.debug("Transcription completed (%d characters, %d words)", len(transcription), word_count)
+        
+        too_short = self._too_short_for_mistral(word_count, user_preferences)
+        if too_short:
+            log.debug("Transcription too short, skipping Mistral")
+        else:
+            # Анализируем через Mistral AI
+            mistral_result = await self._analyze_with_mistral(transcription, user_preferences, video_url)
+            if mistral_result:
+                log.debug("Using Mistral AI analysis")
+                return self._analysis_result(video_info, transcription, mistral_result, word_count), True
+            log.info("Mistral unavailable, using fallback analysis")
+        
+        # Fallback анализ
+        fallback_result = self._fallback_analysis(transcription, user_preferences, word_count=word_count)
+        return self._analysis_result(video_info, transcription, fallback_result, word_count), too_short
+    
     def _download_and_transcribe_audio(self, url: str) -> Dict[str, Any]:
         """
         Скачивает аудио и транскрибирует его
@@ -114,265 +735,445 @@ class VideoAnalyzer:
         try:
             # Создаем временную директорию, которая автоматически удалится
             with tempfile.TemporaryDirectory() as temp_dir:
-                audio_path = os.path.join(temp_dir, "audio.%(ext)s")
-                
-                ydl_opts = {
-                    'quiet': True,
-                    'format': 'bestaudio/best',
-                    'cookiefile': 'cookies.txt',
-                    'ffmpeg_location': r'C:\ffmpeg\bin',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'outtmpl': audio_path,
-                }
-                
-                print("📥 Downloading audio...")
-                with YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
-                
-                # Находим созданный файл
-                final_audio_path = None
-                for file in os.listdir(temp_dir):
-                    if file.startswith("audio."):
-                        final_audio_path = os.path.join(temp_dir, file)
-                        break
-                
-                if not final_audio_path:
-                    return {
-                        'success': False,
-                        'error': "Audio file was not created"
-                    }
-                
-                print(f"🔊 Found audio file: {final_audio_path}")
-                print("🎤 Transcribing audio...")
-                
-                # Транскрибируем
-                audio, sr = librosa.load(final_audio_path, sr=16000)
-                model = load_model('base')
-                transcription = model.transcribe(audio)
-                
+                download_result = self._download_audio(url, temp_dir)
+                if not download_result['success']:
+                    return download_result
+                transcription_result = self._transcribe_file(download_result['audio_path'])
+                # Метаданные уже получены вместе с аудио, повторно yt-dlp не вызывается
+                transcription_result['video_info'] = download_result['video_info']
+                return transcription_result
+        except Exception as e:
+            log.error("Audio transcription failed: %s", e)
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def _download_audio(self, url: str, temp_dir: str) -> Dict[str, Any]:
+        """
+        Скачивает аудиодорожку видео во временную директорию. Метаданные видео
+        приходят из того же вызова yt-dlp
+        """
+        try:
+            ydl = self._download_ydls.get()
+            try:
+                # Экземпляр сейчас принадлежит только этому потоку,
+                # поэтому путь сохранения можно подменить на время вызова
+                ydl.params['outtmpl']['default'] = os.path.join(temp_dir, "audio.%(ext)s")
+                info = ydl.extract_info(url, download=True)
+            finally:
+                self._download_ydls.put(ydl)
+            
+            # Итоговый путь файла yt-dlp сообщает сам, сканировать папку не нужно
+            requested = info.get('requested_downloads') or [{}]
+            audio_path = requested[0].get('filepath')
+            if not audio_path or not os.path.isfile(audio_path):
                 return {
-                    'success': True,
-                    'transcription': transcription['text'],
-                    'language': transcription.get('language', 'unknown')
+                    'success': False,
+                    'error': "Audio file was not created"
                 }
-                
+            
+            return {
+                'success': True,
+                'audio_path': audio_path,
+                'video_info': self._video_info_from_ytdlp(info)
+            }
         except Exception as e:
-            print(f"❌ Audio transcription failed: {e}")
+            log.error("Audio download failed: %s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
-
-    def _analyze_with_mistral(self, transcription: str, user_preferences: Dict[str, Any], video_url: str) -> Dict[str, Any]:
+    
+    def _transcribe_file(self, audio_path: str) -> Dict[str, Any]:
         """
-        Анализ транскрипции с помощью Mistral AI
+        Транскрибирует скачанный аудиофайл
         """
-        if not self.mistral_api_key or self.mistral_api_key == "your-mistral-api-key-here":
-            return None
-        
         try:
-            prompt = self._build_mistral_prompt(transcription, user_preferences)
+            log.debug("Transcribing audio file %s", audio_path)
             
-            headers = {
-                "Authorization": f"Bearer {self.mistral_api_key}",
-                "Content-Type": "application/json"
-            }
+            # Файл декодируется внутри faster-whisper, сегменты отдаются
+            # лениво и читаются до удаления временной папки
+            model = self._get_model()
+            segments, info = model.transcribe(audio_path, beam_size=1, vad_filter=True)
+            transcription = "".join(segment.text for segment in segments).strip()
             
-            payload = {
-                "model": "mistral-medium",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "Ты - AI помощник для анализа YouTube видео. Анализируй ТОЛЬКО на основе транскрибированного текста. Отвечай ТОЛЬКО в формате JSON."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000,
-                "response_format": {"type": "json_object"}
+            return {
+                'success': True,
+                'transcription': transcription,
+                'language': info.language or 'unknown'
             }
+        except Exception as e:
+            log.error("Audio transcription failed: %s", e)
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    async def _analyze_with_mistral(self, transcription: str, user_preferences: Dict[str, Any], video_url: str) -> Dict[str, Any]:
+        """
+        Анализ транскрипции с помощью Mistral AI
+        """
+        try:
+            prompt = self._build_mistral_prompt(transcription, user_preferences)
+            cache_key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+            cached = await asyncio.to_thread(self._mistral_cache.get, cache_key)
+            if cached is not None:
+                log.debug("Using cached Mistral analysis")
+                return cached
             
-            print("🚀 Sending request to Mistral AI...")
-            response = requests.post(self.mistral_api_url, headers=headers, json=payload, timeout=60)
-            
-            if response.status_code == 200:
-                result = response.json()
-                analysis_text = result['choices'][0]['message']['content']
-                print(f"📝 Mistral AI response received")
-                
-                parsed_result = self._parse_mistral_response(analysis_text)
-                if parsed_result:
-                    print(f"✅ Mistral analysis completed: suitable={parsed_result.get('is_suitable')}, score={parsed_result.get('match_score')}")
-                    return parsed_result
-            else:
-                print(f"❌ Mistral API error: {response.status_code} - {response.text}")
+            analysis_text = await self._complete_mistral(prompt, max_tokens=1000)
+            if analysis_text is None:
                 return None
+            
+            parsed_result = self._parse_mistral_response(analysis_text)
+            if parsed_result:
+                log.debug("Mistral analysis completed: suitable=%s, score=%s", parsed_result.get('is_suitable'), parsed_result.get('match_score'))
+                await asyncio.to_thread(self._mistral_cache.set, cache_key, parsed_result, expire=self.mistral_cache_ttl)
+                return parsed_result
+            return None
                 
         except Exception as e:
-            print(f"❌ Mistral AI analysis failed: {e}")
+            log.error("Mistral AI analysis failed: %s", e)
             return None
     
-    def _build_mistral_prompt(self, transcription: str, user_preferences: Dict[str, Any]) -> str:
+    async def _analyze_batch_with_mistral(self, transcriptions: List[str], user_preferences: Dict[str, Any]) -> List[Optional[Dict[str, Any]]]:
         """
-        Строит промпт для Mistral AI на основе транскрипции
+        Анализ нескольких транскрипций одним запросом. Для видео, по которым
+        Mistral не дал корректного ответа, в списке остается None
         """
-        # Обрезаем транскрипцию если слишком длинная
-        max_transcription_length = 4000
-        if len(transcription) > max_transcription_length:
-            transcription = transcription[:max_transcription_length] + "... [текст обрезан]"
+        if len(transcriptions) == 1:
+            return [await self._analyze_with_mistral(transcriptions[0], user_preferences, None)]
         
-        # Предпочтения пользователя
-        user_categories = user_preferences.get('preferred_categories', [])
-        user_languages = user_preferences.get('preferred_languages', ['русский'])
-        educational_pref = user_preferences.get('educational_preference', False)
-        entertainment_pref = user_preferences.get('entertainment_preference', True)
-        exclude_explicit = user_preferences.get('exclude_explicit_content', False)
-        min_content_length = user_preferences.get('min_content_length', 100)
+        try:
+            prompt = self._build_batch_prompt(transcriptions, user_preferences)
+            analysis_text = await self._complete_mistral(prompt, max_tokens=min(4000, 600 * len(transcriptions)))
+            if analysis_text is None:
+                return [None] * len(transcriptions)
+            return self._parse_mistral_batch_response(analysis_text, len(transcriptions))
         
-        word_count = len(transcription.split())
+        except Exception as e:
+            log.error("Mistral AI batch analysis failed: %s", e)
+            return [None] * len(transcriptions)
+    
+    async def _complete_mistral(self, prompt: str, max_tokens: int) -> Optional[str]:
+        """
+        Отправляет промпт в Mistral и возвращает JSON-текст ответа
+        """
+        if not self.mistral_api_key or self.mistral_api_key == "your-mistral-api-key-here":
+            return None
         
-        prompt = f"""
-        ПРОАНАЛИЗИРУЙ транскрибированный текст YouTube видео на соответствие предпочтениям пользователя.
-
-        === ТРАНСКРИБИРОВАННЫЙ ТЕКСТ ВИДЕО ===
-        {transcription}
-
-        === СТАТИСТИКА ТЕКСТА ===
-        Общее количество слов: {word_count}
-
-        === ПРЕДПОЧТЕНИЯ ПОЛЬЗОВАТЕЛЯ ===
-        ЖЕЛАЕМЫЕ ТЕМАТИКИ: {user_categories}
-        ПРЕДПОЧТИТЕЛЬНЫЕ ЯЗЫКИ: {user_languages}
-        МИНИМАЛЬНЫЙ ОБЪЕМ КОНТЕНТА: {min_content_length} слов
-        ОБРАЗОВАТЕЛЬНЫЙ КОНТЕНТ: {"ДА" if educational_pref else "НЕТ"}
-        РАЗВЛЕКАТЕЛЬНЫЙ КОНТЕНТ: {"ДА" if entertainment_pref else "НЕТ"}
-        ИСКЛЮЧАТЬ ЯВНЫЙ КОНТЕНТ: {"ДА" if exclude_explicit else "НЕТ"}
-
-        === КРИТЕРИИ АНАЛИЗА ===
-        1. СОДЕРЖАТЕЛЬНОСТЬ: Достаточно ли текста для анализа? Минимум {min_content_length} слов
-        2. ТЕМАТИКА: Соответствует ли содержание видео желаемым тематикам?
-        3. ТИП КОНТЕНТА: Образовательный или развлекательный согласно предпочтениям?
-        4. ЯЗЫК: Соответствует ли язык предпочтительным языкам?
-        5. КАЧЕСТВО: Есть ли признаки явного или нежелательного контента?
-
-        === ТРЕБУЕМЫЙ ФОРМАТ ОТВЕТА ===
-        Ответь ТОЛЬКО в формате JSON:
-
-        {{
-            "is_suitable": true/false,
-            "analysis": "Детальный анализ на русском языке",
-            "confidence": 0.85,
-            "reasons": [
-                "Причина 1",
-                "Причина 2", 
-                "Причина 3"
+        headers = {
+            "Authorization": f"Bearer {self.mistral_api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": "mistral-medium",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": _SYSTEM_PROMPT
+                },
+                {
+                    "role": "user", 
+                    "content": prompt
+                }
             ],
-            "match_score": 85,
-            "detected_topics": ["тема1", "тема2"],
-            "content_type": "educational/entertainment/mixed/unknown",
-            "language_detected": "русский/английский/другой"
-        }}
-
-        Будь объективным и анализируй только представленный текст.
+            "temperature": 0.7,
+            "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"},
+            "stream": True
+        }
+        
+        # Оценка расхода токенов: промпт плюс лимит ответа
+        estimated_tokens = len(prompt) // _CHARS_PER_TOKEN + max_tokens
+        return await self._stream_mistral(headers, payload, estimated_tokens)
+    
+    def _hedge_delay(self) -> float:
+        """
+        Задержка перед дублирующим запросом - P95 последних ответов Mistral
+        """
+        if len(self._mistral_latencies) < 20:
+            return self.default_hedge_delay
+        latencies = sorted(self._mistral_latencies)
+        return latencies[int(len(latencies) * 0.95) - 1]
+    
+    async def _stream_mistral(self, headers: Dict[str, str], payload: Dict[str, Any], estimated_tokens: int) -> Optional[str]:
+        """
+        Отправляет запрос в Mistral с учетом лимитов скорости. На 429 ждет
+        Retry-After (со случайной добавкой) и повторяет запрос один раз.
+        Пауза общая: ее соблюдают все запросы
+        """
+        stream_headers = {**headers, "Accept": "text/event-stream"}
+        # Тело сериализуем через orjson сами (Content-Type уже задан в headers)
+        body = orjson.dumps(payload)
+        
+        for attempt in range(2):
+            wait = self._mistral_not_before - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with self._mistral_semaphore:
+                await self._mistral_requests.acquire()
+                await self._mistral_tokens.acquire(estimated_tokens)
+                # Очередь на лимиты пройдена: hedging и замер задержки
+                # касаются только самого запроса
+                status, text, retry_after = await self._hedged(
+                    lambda: self._post_mistral(stream_headers, body), estimated_tokens
+                )
+            if status == 200:
+                return text
+            if status != 429 or attempt > 0:
+                log.error("Mistral API error: %s - %s", status, text)
+                return None
+            
+            # Ждем вне семафора, чтобы не занимать слот
+            retry_after = _retry_after_seconds(retry_after)
+            delay = retry_after + random.uniform(0, retry_after or 1.0)
+            log.warning("Mistral rate limit hit, retrying in %.1fs", delay)
+            self._mistral_not_before = max(self._mistral_not_before, time.monotonic() + delay)
+        return None
+    
+    async def _post_mistral(self, headers: Dict[str, str], body: bytes) -> Tuple[int, str, Optional[str]]:
         """
+        Один POST в Mistral: (статус, ответ или текст ошибки, Retry-After)
+        """
+        async with self.http_client.stream("POST", self.mistral_api_url, headers=headers, content=body) as response:
+            if response.status_code == 200:
+                return 200, await self._read_mistral_stream(response), None
+            error_body = await response.aread()
+            return response.status_code, error_body.decode(errors='replace'), response.headers.get("Retry-After")
+    
+    @staticmethod
+    async def _read_mistral_stream(response: httpx.Response) -> str:
+        """
+        Читает SSE-поток Mistral и возвращает JSON ответа, как только объект закрыт.
+        Поток прерывается сразу после этого, не дожидаясь конца генерации
+        """
+        scanner = JsonObjectScanner()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            
+            chunk = orjson.loads(data)
+            choices = chunk.get('choices') or [{}]
+            content = choices[0].get('delta', {}).get('content')
+            if content and scanner.feed(content):
+                break
+        
+        return scanner.text()
+    
+    async def _hedged(self, call: Callable[[], Awaitable[Any]], estimated_tokens: int) -> Any:
+        """
+        Вызов Mistral с hedging: возвращает результат попытки, завершившейся первой,
+        вторая попытка отменяется. Вызывающий уже занял слот и токены для первой
+        попытки, дубль берет свои и только если они есть без ожидания
+        """
+        async def send():
+            started = time.monotonic()
+            result = await call()
+            self._mistral_latencies.append(time.monotonic() - started)
+            return result
+        
+        async def send_hedge():
+            async with self._mistral_semaphore:
+                return await send()
+        
+        first = asyncio.create_task(send())
+        if not self.hedging_enabled:
+            return await first
+        
+        # Задачи отменяются и при отмене самого вызова, в том числе во время
+        # ожидания первой попытки
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self._hedge_delay())
+            if done:
+                return first.result()
+            if not self._reserve_hedge(estimated_tokens):
+                # Процесс упирается в лимиты - дубль только добавил бы нагрузки
+                return await first
+            
+            log.debug("Mistral is slow, sending hedged request")
+            pending.add(asyncio.create_task(send_hedge()))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Обе попытки завершились ошибкой
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def _reserve_hedge(self, estimated_tokens: int) -> bool:
+        # Дубль не ждет: ни паузы после 429, ни свободного слота, ни токенов
+        if self._mistral_not_before > time.monotonic() or self._mistral_semaphore.locked():
+            return False
+        return self._mistral_requests.try_acquire() and self._mistral_tokens.try_acquire(estimated_tokens)
+    
+    @staticmethod
+    def _clean_transcription(transcription: str, max_tokens: int) -> str:
+        # Убираем ссылки и лишние пробелы. Слишком длинный текст сокращаем
+        # до начала и конца: в них обычно тема видео и выводы
+        transcription = _WS_RE.sub(" ", _URL_RE.sub("", transcription)).strip()
+        half = max_tokens * _CHARS_PER_TOKEN // 2
+        if len(transcription) > 2 * half:
+            # Режем по границам слов
+            head = transcription[:half].rsplit(" ", 1)[0]
+            tail = transcription[-half:].split(" ", 1)[-1]
+            transcription = f"{head} ... [середина пропущена] ... {tail}"
+        return transcription
+    
+    @staticmethod
+    def _format_preferences(user_preferences: Dict[str, Any]) -> str:
+        # Предпочтения пользователя - в промпт попадают только заданные
+        user_categories = user_preferences.get('preferred_categories', [])
+        user_languages = user_preferences.get('preferred_languages', ['русский'])
         
-        return prompt
+        content_types = []
+        if user_preferences.get('educational_preference', False):
+            content_types.append("образовательный")
+        if user_preferences.get('entertainment_preference', True):
+            content_types.append("развлекательный")
+        
+        preferences = []
+        if user_categories:
+            preferences.append(f"Тематики: {', '.join(user_categories)}")
+        if user_languages:
+            preferences.append(f"Языки: {', '.join(user_languages)}")
+        if content_types:
+            preferences.append(f"Тип контента: {', '.join(content_types)}")
+        if user_preferences.get('exclude_explicit_content', False):
+            preferences.append("Исключать явный контент")
+        
+        return "\n".join(preferences) or "не заданы"
+    
+    def _build_mistral_prompt(self, transcription: str, user_preferences: Dict[str, Any]) -> str:
+        """
+        Строит промпт для Mistral AI на основе транскрипции
+        """
+        transcription = self._clean_transcription(transcription, max_tokens=1400)
+        return _PROMPT_TEMPLATE.format_map({
+            'transcription': transcription,
+            'word_count': len(transcription.split()),
+            'preferences': self._format_preferences(user_preferences),
+            'min_content_length': user_preferences.get('min_content_length', 100)
+        })
+    
+    def _build_batch_prompt(self, transcriptions: List[str], user_preferences: Dict[str, Any]) -> str:
+        """
+        Строит один промпт для нескольких транскрипций, видео нумеруются с 0
+        """
+        videos = []
+        for index, transcription in enumerate(transcriptions):
+            transcription = self._clean_transcription(transcription, max_tokens=500)
+            videos.append(_BATCH_VIDEO_TEMPLATE.format_map({
+                'index': index,
+                'word_count': len(transcription.split()),
+                'transcription': transcription
+            }))
+        return _BATCH_PROMPT_TEMPLATE.format_map({
+            'videos': "\n".join(videos),
+            'preferences': self._format_preferences(user_preferences),
+            'min_content_length': user_preferences.get('min_content_length', 100)
+        })
     
     def _parse_mistral_response(self, response_text: str) -> Dict[str, Any]:
         """
         Парсит JSON ответ от Mistral AI
         """
+        # Ответ бывает обернут в ``` или текст: берем первый сбалансированный {...}
+        scanner = JsonObjectScanner()
+        scanner.feed(response_text)
         try:
-            clean_text = response_text.strip()
-            result = json.loads(clean_text)
-            
-            required_fields = ['is_suitable', 'analysis', 'confidence', 'reasons', 'match_score']
-            if all(field in result for field in required_fields):
-                if (isinstance(result['is_suitable'], bool) and
-                    isinstance(result['analysis'], str) and
-                    isinstance(result['confidence'], (int, float)) and
-                    isinstance(result['reasons'], list) and
-                    isinstance(result['match_score'], (int, float))):
-                    
-                    result['confidence'] = max(0.0, min(1.0, float(result['confidence'])))
-                    result['match_score'] = max(0, min(100, int(result['match_score'])))
-                    
-                    if 'detected_topics' not in result:
-                        result['detected_topics'] = []
-                    if 'content_type' not in result:
-                        result['content_type'] = 'unknown'
-                    if 'language_detected' not in result:
-                        result['language_detected'] = 'unknown'
-                    
-                    return result
-            
-            print(f"❌ Invalid response format from Mistral: {result}")
-            return None
-            
-        except json.JSONDecodeError as e:
-            print(f"❌ Failed to parse JSON response from Mistral: {e}")
-            return None
-        except Exception as e:
-            print(f"❌ Error parsing Mistral response: {e}")
+            return MistralResult.model_validate_json(scanner.text()).model_dump()
+        except ValidationError as e:
+            log.warning("Invalid response format from Mistral: %s", e)
             return None
     
-    def _fallback_analysis(self, transcription: str, user_preferences: Dict[str, Any]) -> Dict[str, Any]:
+    def _parse_mistral_batch_response(self, response_text: str, count: int) -> List[Optional[Dict[str, Any]]]:
         """
-        Простой анализ если Mistral недоступен
+        Парсит пакетный ответ Mistral: {"results": [{"index": ..., ...}]}.
+        Некорректные элементы пропускаются, остальные видео не страдают
         """
-        transcription_lower = transcription.lower()
-        word_count = len(transcription.split())
+        results = [None] * count
+        scanner = JsonObjectScanner()
+        scanner.feed(response_text)
+        try:
+            items = orjson.loads(scanner.text()).get('results')
+        except (orjson.JSONDecodeError, AttributeError) as e:
+            log.warning("Failed to parse batch response from Mistral: %s", e)
+            return results
+        
+        for item in items if isinstance(items, list) else ():
+            try:
+                parsed = MistralBatchItem.model_validate(item)
+            except ValidationError as e:
+                log.warning("Invalid batch item from Mistral: %s", e)
+                continue
+            if 0 <= parsed.index < count:
+                results[parsed.index] = parsed.model_dump(exclude={'index'})
+        return results
+    
+    def _fallback_analysis(self, transcription: str, user_preferences: Dict[str, Any], category_automaton=None, word_count: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Простой анализ если Mistral недоступен. category_automaton можно
+        передать готовым, если предпочтения одни для нескольких видео,
+        word_count - если число слов уже посчитано
+        """
+        # Текст нормализуется один раз, дальше все проверки идут по нему
+        transcription_lower = normalize_text(transcription)
+        if word_count is None:
+            word_count = len(transcription.split())
         
         score = 50
-        reasons = []
+        codes = []
         detected_topics = []
         
         # Проверка объема контента
         min_content_length = user_preferences.get('min_content_length', 100)
         if word_count < min_content_length:
             score -= 30
-            reasons.append(f"Слишком мало контента ({word_count} слов)")
+            codes.append(REASON_CONTENT_SHORT)
         else:
             score += 10
-            reasons.append(f"Достаточный объем контента ({word_count} слов)")
+            codes.append(REASON_CONTENT_OK)
         
         # Анализ тематик
         preferred_categories = user_preferences.get('preferred_categories', [])
         if preferred_categories:
-            category_matches = []
-            for category in preferred_categories:
-                if category.lower() in transcription_lower:
-                    category_matches.append(category)
-                    detected_topics.append(category)
+            if category_automaton is None:
+                category_automaton = build_category_automaton(preferred_categories)
+            if category_automaton is not None:
+                found = {key for _, key in category_automaton.iter(transcription_lower)}
+                detected_topics = [category for category in preferred_categories if normalize_text(category) in found]
             
-            if category_matches:
+            if detected_topics:
                 score += 20
-                reasons.append(f"Найдены тематики: {', '.join(category_matches)}")
+                codes.append(REASON_TOPICS_FOUND)
             else:
                 score -= 15
-                reasons.append("Тематики не соответствуют предпочтениям")
+                codes.append(REASON_TOPICS_MISSING)
+        
+        # Один проход по тексту: какие ключевые слова каждой группы встретились
+        matched = defaultdict(set)
+        for _, (group, keyword) in self._keyword_automaton.iter(transcription_lower):
+            matched[group].add(keyword)
         
         # Проверка на явный контент
         if user_preferences.get('exclude_explicit_content', False):
-            explicit_keywords = ['мат', 'ругательство', 'оскорбление', 'порно', 'секс', 'насилие']
-            explicit_found = any(keyword in transcription_lower for keyword in explicit_keywords)
-            if explicit_found:
+            if matched['explicit']:
                 score -= 40
-                reasons.append("Обнаружен нежелательный контент")
+                codes.append(REASON_EXPLICIT)
         
         # Определение типа контента
-        educational_keywords = ['обучение', 'урок', 'курс', 'лекция', 'образование']
-        entertainment_keywords = ['развлечение', 'юмор', 'смех', 'прикол', 'комедия']
-        
-        edu_count = sum(1 for kw in educational_keywords if kw in transcription_lower)
-        ent_count = sum(1 for kw in entertainment_keywords if kw in transcription_lower)
+        edu_count = len(matched['educational'])
+        ent_count = len(matched['entertainment'])
         
         if edu_count > ent_count:
             content_type = "educational"
@@ -387,6 +1188,10 @@ class VideoAnalyzer:
         
         is_suitable = score >= 60
         
+        # Строки формируются только здесь, по уже известным кодам
+        details = {'word_count': word_count, 'topics': ', '.join(detected_topics)}
+        reasons = [_REASON_MESSAGES[code].format_map(details) for code in codes]
+        
         return {
             'is_suitable': is_suitable,
             'analysis': f"Fallback анализ: контент {'соответствует' if is_suitable else 'не соответствует'} предпочтениям",
@@ -0,0 +1,91 @@
+import os
+import time
+import logging
+from collections import OrderedDict, namedtuple
+from typing import Optional, Dict, Any
+
+import orjson
+import redis.asyncio as aioredis
+
+log = logging.getLogger(__name__)
+
+SESSION_TTL_SECONDS = 3600  # 1 час
+
+# Минимальные данные пользователя, которые хранятся прямо в сессии,
+# чтобы не обращаться к базе на каждый запрос
+UserCtx = namedtuple("UserCtx", ["id", "email", "username"])
+
+def session_payload(user) -> Dict[str, Any]:
+    return {"user_id": user.id, "email": user.email, "username": user.username}
+
+class SessionStore:
+    """
+    Хранилище сессий в Redis (общее для всех воркеров).
+    Если REDIS_URL не задан или Redis недоступен, используется локальный
+    LRU-словарь - подходит только для разработки с одним процессом
+    """
+    key_prefix = "session:"
+
+    def __init__(self, redis_url: Optional[str] = None, ttl: int = SESSION_TTL_SECONDS, max_local_sessions: int = 10000):
+        self.redis_url = redis_url if redis_url is not None else os.getenv("REDIS_URL")
+        self.ttl = ttl
+        self.max_local_sessions = max_local_sessions
+        self.redis = None
+        # session_id -> (payload, expires_at)
+        self._local = OrderedDict()
+
+    async def connect(self):
+        if not self.redis_url:
+            log.info("REDIS_URL not set, using in-memory sessions")
+            return
+
+        try:
+            client = aioredis.from_url(self.redis_url, decode_responses=True)
+            await client.ping()
+            self.redis = client
+            log.info("Redis session store connected")
+        except Exception as e:
+            log.warning("Redis unavailable, using in-memory sessions: %s", e)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+    async def set(self, session_id: str, payload: Dict[str, Any]):
+        if self.redis is not None:
+            await self.redis.set(self.key_prefix + session_id, orjson.dumps(payload), ex=self.ttl)
+            return
+
+        self._local[session_id] = (payload, time.monotonic() + self.ttl)
+        self._local.move_to_end(session_id)
+        while len(self._local) > self.max_local_sessions:
+            self._local.popitem(last=False)
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.redis is not None:
+            value = await self.redis.get(self.key_prefix + session_id)
+            if value is None:
+                return None
+            payload = orjson.loads(value)
+            # Сессии старого формата хранили только user_id
+            if isinstance(payload, int):
+                return {"user_id": payload}
+            return payload
+
+        entry = self._local.get(session_id)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._local[session_id]
+            return None
+        self._local.move_to_end(session_id)
+        return payload
+
+    async def delete(self, session_id: str):
+        if self.redis is not None:
+            await self.redis.delete(self.key_prefix + session_id)
+            return
+
+        self._local.pop(session_id, None)